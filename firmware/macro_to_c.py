@@ -11,10 +11,21 @@ Usage:
 import json
 import sys
 import argparse
-import base64
 import re
 import os
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, TextIO, Tuple
+
+# pybase64 wraps libbase64's SIMD decoder and mirrors the stdlib API
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# orjson parses large recorded macros several times faster than the stdlib
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 
 # Button bit masks (matching C# SwitchControllerConstants)
@@ -33,25 +44,63 @@ DPAD = {
     'NEUTRAL': 0x08
 }
 
-# Stick cardinal positions
+# Stick cardinal positions, packed as (x << 8) | y
 LEFT_STICK = {
-    'LUP': (128, 0), 'LDOWN': (128, 255), 'LLEFT': (0, 128), 'LRIGHT': (255, 128),
-    'LUPLEFT': (0, 0), 'LUPRIGHT': (255, 0), 'LDOWNLEFT': (0, 255), 'LDOWNRIGHT': (255, 255)
+    'LUP': 0x8000, 'LDOWN': 0x80FF, 'LLEFT': 0x0080, 'LRIGHT': 0xFF80,
+    'LUPLEFT': 0x0000, 'LUPRIGHT': 0xFF00, 'LDOWNLEFT': 0x00FF, 'LDOWNRIGHT': 0xFFFF
 }
 
 RIGHT_STICK = {
-    'RUP': (128, 0), 'RDOWN': (128, 255), 'RLEFT': (0, 128), 'RRIGHT': (255, 128),
-    'RUPLEFT': (0, 0), 'RUPRIGHT': (255, 0), 'RDOWNLEFT': (0, 255), 'RDOWNRIGHT': (255, 255)
+    'RUP': 0x8000, 'RDOWN': 0x80FF, 'RLEFT': 0x0080, 'RRIGHT': 0xFF80,
+    'RUPLEFT': 0x0000, 'RUPRIGHT': 0xFF00, 'RDOWNLEFT': 0x00FF, 'RDOWNRIGHT': 0xFFFF
+}
+
+# Every named input mapped to (kind, value) so each token needs a single lookup
+INPUT_TOKENS = {
+    **{name: ('button', mask) for name, mask in BUTTONS.items()},
+    **{name: ('dpad', hat) for name, hat in DPAD.items()},
+    **{name: ('left_stick', pos) for name, pos in LEFT_STICK.items()},
+    **{name: ('right_stick', pos) for name, pos in RIGHT_STICK.items()},
 }
 
 NEUTRAL_KEYWORDS = {'WAIT', 'NOTHING', 'NEUTRAL'}
 
+# No buttons, D-Pad released, both sticks centered
+NEUTRAL_PACKET = bytes((0, 0, DPAD['NEUTRAL'], 128, 128, 128, 128, 0))
+
 MAX_INCLUDE_DEPTH = 10
 
 USB_FRAME_INTERVAL_MS = 8  # 125Hz USB polling (must match firmware descriptor)
 
+PACKET_SIZE = 8  # Bytes per input report (must match EmbeddedMacroFrame_t.packet)
+
+# Everything from the first '#' or '//' to the end of the line
+COMMENT_RE = re.compile(r'(#|//).*')
+
+# Analog stick position: L(x,y) or R(x,y), coordinates in decimal or hex
+STICK_RE = re.compile(r'([LR])\s*\(\s*(\d+|0x[0-9A-Fa-f]+)\s*,\s*(\d+|0x[0-9A-Fa-f]+)\s*\)', re.IGNORECASE)
+
+FRAME_LINE = "    { %d, { %s } }"
+
+FRAME_CHUNK_SIZE = 1024  # Frame entries rendered per format call when writing the header
 
-def parse_text_macro(file_path: str, include_chain: Optional[set] = None, depth: int = 0) -> List[Dict[str, Any]]:
+
+def parse_int(text: str) -> int:
+    """
+    Parse a decimal or 0x-prefixed hexadecimal integer.
+
+    int(text, 0) would also detect the base, but it rejects decimal values
+    with leading zeros such as "05", which macros have always accepted.
+    """
+    return int(text, 16) if text.startswith(('0x', '0X')) else int(text)
+
+
+def parse_text_macro(
+    file_path: str,
+    include_chain: Optional[set] = None,
+    depth: int = 0,
+    include_cache: Optional[Dict[Tuple[str, int], List[Dict[str, Any]]]] = None
+) -> List[Dict[str, Any]]:
     """
     Parse a human-readable text macro file into frame format with include support.
 
@@ -59,13 +108,16 @@ def parse_text_macro(file_path: str, include_chain: Optional[set] = None, depth:
         file_path: Path to the .macro text file
         include_chain: Set of already included files (for circular dependency detection)
         depth: Current include depth (for max depth checking)
+        include_cache: Frames of already parsed includes, keyed by (path, depth)
 
     Returns:
-        List of frames in the same format as JSON: [{'TimestampMs': int, 'Packet': [bytes]}]
+        List of frames in the same shape as JSON: [{'TimestampMs': int, 'Packet': bytes}]
     """
     # Initialize include chain if this is the top-level call
     if include_chain is None:
         include_chain = set()
+    if include_cache is None:
+        include_cache = {}
 
     # Get absolute path for this file
     abs_file_path = os.path.abspath(file_path)
@@ -82,26 +134,22 @@ def parse_text_macro(file_path: str, include_chain: Optional[set] = None, depth:
         print(f"Error: Circular include detected: {chain_str}", file=sys.stderr)
         sys.exit(1)
 
-    include_chain = include_chain | {abs_file_path}
-
-    frames = []
-    current_timestamp = 0
-    prev_state = None
+    include_chain.add(abs_file_path)
+    try:
+        frames = []
+        current_timestamp = 0
+        prev_state = None
 
-    with open(file_path, 'r') as f:
-        for line_num, line in enumerate(f, 1):
-            line = line.strip()
+        # Read the whole file at once; text mode has already normalized line endings to '\n'
+        with open(file_path, 'r') as f:
+            lines = f.read().split('\n')
 
-            # Skip empty lines and comments
-            if not line or line.startswith('#') or line.startswith('//'):
+        for line_num, line in enumerate(lines, 1):
+            # Remove comments, then skip lines left empty
+            line = COMMENT_RE.sub('', line).strip()
+            if not line:
                 continue
 
-            # Remove inline comments
-            if '#' in line:
-                line = line[:line.index('#')].strip()
-            if '//' in line:
-                line = line[:line.index('//')].strip()
-
             # Handle include directive
             if line.startswith('@'):
                 include_directive = line[1:].strip()
@@ -126,28 +174,28 @@ def parse_text_macro(file_path: str, include_chain: Optional[set] = None, depth:
                         sys.exit(1)
 
                 try:
-                    # Resolve path relative to base directory
-                    if os.path.isabs(include_path):
-                        full_include_path = include_path
-                    else:
-                        full_include_path = os.path.abspath(os.path.join(base_directory, include_path))
-
-                    # Check if file exists
-                    if not os.path.exists(full_include_path):
-                        print(f"Error on line {line_num}: Include file not found: {full_include_path}", file=sys.stderr)
-                        sys.exit(1)
-
-                    # Recursively parse included file
-                    included_frames = parse_text_macro(full_include_path, include_chain, depth + 1)
+                    # Resolve path relative to base directory, which is already absolute
+                    full_include_path = os.path.normpath(os.path.join(base_directory, include_path))
+
+                    # Recursively parse included file, reusing the result if it was already included.
+                    # A file that parsed once has no reachable cycle, so only its depth can change the outcome
+                    cache_key = (full_include_path, depth + 1)
+                    included_frames = include_cache.get(cache_key)
+                    if included_frames is None:
+                        try:
+                            included_frames = parse_text_macro(full_include_path, include_chain, depth + 1, include_cache)
+                        except FileNotFoundError:
+                            print(f"Error on line {line_num}: Include file not found: {full_include_path}", file=sys.stderr)
+                            sys.exit(1)
+                        include_cache[cache_key] = included_frames
 
                     # Merge included frames into current frames, repeating loop_count times
                     for loop in range(loop_count):
-                        # Merge included frames into current frames, adjusting timestamps
-                        for included_frame in included_frames:
-                            # Skip the final neutral frame from included file (except on last loop)
-                            if included_frame == included_frames[-1] and loop < loop_count - 1:
-                                continue
+                        # Skip the final neutral frame from included file (except on last loop)
+                        merged_frames = included_frames if loop == loop_count - 1 else included_frames[:-1]
 
+                        # Merge included frames into current frames, adjusting timestamps
+                        for included_frame in merged_frames:
                             # Adjust timestamp to be relative to current position
                             adjusted_timestamp = current_timestamp + included_frame['TimestampMs']
                             frames.append({
@@ -170,28 +218,16 @@ def parse_text_macro(file_path: str, include_chain: Optional[set] = None, depth:
             # Parse line: inputs,duration
             # Need to handle commas inside L(x,y) or R(x,y)
             try:
-                # Find the last comma that's not inside parentheses
-                paren_depth = 0
-                split_pos = -1
-                for i, char in enumerate(line):
-                    if char == '(':
-                        paren_depth += 1
-                    elif char == ')':
-                        paren_depth -= 1
-                    elif char == ',' and paren_depth == 0:
-                        split_pos = i
-
-                if split_pos == -1:
+                # The duration follows the last comma; a ')' after it means that comma was inside L(x,y)/R(x,y)
+                inputs_part, separator, duration_part = line.rpartition(',')
+                if not separator or ')' in duration_part:
                     raise ValueError("Missing comma separator between inputs and duration")
 
-                inputs_part = line[:split_pos].strip()
-                duration_part = line[split_pos+1:].strip()
+                inputs_part = inputs_part.strip()
+                duration_part = duration_part.strip()
 
                 # Parse duration in frames (support hex with 0x prefix)
-                if duration_part.lower().startswith('0x'):
-                    duration_frames = int(duration_part, 16)
-                else:
-                    duration_frames = int(duration_part)
+                duration_frames = parse_int(duration_part)
 
                 if duration_frames < 0:
                     raise ValueError(f"Duration cannot be negative")
@@ -205,7 +241,7 @@ def parse_text_macro(file_path: str, include_chain: Optional[set] = None, depth:
                 # Add frame
                 frames.append({
                     'TimestampMs': current_timestamp,
-                    'Packet': list(packet)
+                    'Packet': bytes(packet)
                 })
 
                 current_timestamp += duration
@@ -215,18 +251,19 @@ def parse_text_macro(file_path: str, include_chain: Optional[set] = None, depth:
                 print(f"Error on line {line_num}: {e}", file=sys.stderr)
                 sys.exit(1)
 
-    # Add final neutral frame to release all inputs
-    if frames:
-        neutral_packet = [0, 0, DPAD['NEUTRAL'], 128, 128, 128, 128, 0]
-        frames.append({
-            'TimestampMs': current_timestamp,
-            'Packet': neutral_packet
-        })
+        # Add final neutral frame to release all inputs
+        if frames:
+            frames.append({
+                'TimestampMs': current_timestamp,
+                'Packet': NEUTRAL_PACKET
+            })
 
-    return frames
+        return frames
+    finally:
+        include_chain.discard(abs_file_path)
 
 
-def build_packet(inputs_str: str, prev_packet: Optional[List[int]], line_num: int) -> List[int]:
+def build_packet(inputs_str: str, prev_packet: Optional[bytes], line_num: int) -> bytearray:
     """
     Build an 8-byte packet from an input string.
 
@@ -236,34 +273,46 @@ def build_packet(inputs_str: str, prev_packet: Optional[List[int]], line_num: in
         line_num: Line number for error reporting
 
     Returns:
-        8-byte packet as list
+        8-byte packet as bytearray
     """
     # Start with neutral packet
     # Each line specifies the complete state - no inheritance from previous commands
-    packet = [0, 0, DPAD['NEUTRAL'], 128, 128, 128, 128, 0]
+    packet = bytearray(NEUTRAL_PACKET)
 
     # Check for neutral/wait state
     if not inputs_str or inputs_str.upper() in NEUTRAL_KEYWORDS:
-        # Reset to neutral
-        return [0, 0, DPAD['NEUTRAL'], 128, 128, 128, 128, 0]
-
-    # Parse inputs (separated by +)
-    inputs = [inp.strip() for inp in inputs_str.split('+') if inp.strip()]
+        return packet
 
     buttons = 0
     hat = DPAD['NEUTRAL']
-    left_stick_set = False
-    right_stick_set = False
 
-    for inp in inputs:
-        inp_upper = inp.upper()
+    # Parse inputs (separated by +)
+    for inp in inputs_str.split('+'):
+        inp = inp.strip()
+        if not inp:
+            continue
+
+        token = INPUT_TOKENS.get(inp.upper())
+        if token is not None:
+            kind, value = token
+            if kind == 'button':
+                buttons |= value
+            elif kind == 'dpad':
+                hat = value
+            elif kind == 'left_stick':
+                packet[3] = value >> 8
+                packet[4] = value & 0xFF
+            else:
+                packet[5] = value >> 8
+                packet[6] = value & 0xFF
+            continue
 
         # Check for complex analog: L(x,y) or R(x,y)
-        match = re.match(r'([LR])\s*\(\s*(\d+|0x[0-9A-Fa-f]+)\s*,\s*(\d+|0x[0-9A-Fa-f]+)\s*\)', inp, re.IGNORECASE)
+        match = STICK_RE.match(inp)
         if match:
             stick, x_str, y_str = match.groups()
-            x = int(x_str, 16 if x_str.lower().startswith('0x') else 10)
-            y = int(y_str, 16 if y_str.lower().startswith('0x') else 10)
+            x = parse_int(x_str)
+            y = parse_int(y_str)
 
             if not (0 <= x <= 255 and 0 <= y <= 255):
                 raise ValueError(f"Stick coordinates must be 0-255: {inp}")
@@ -271,37 +320,9 @@ def build_packet(inputs_str: str, prev_packet: Optional[List[int]], line_num: in
             if stick.upper() == 'L':
                 packet[3] = x
                 packet[4] = y
-                left_stick_set = True
             else:
                 packet[5] = x
                 packet[6] = y
-                right_stick_set = True
-            continue
-
-        # Check for button
-        if inp_upper in BUTTONS:
-            buttons |= BUTTONS[inp_upper]
-            continue
-
-        # Check for D-Pad
-        if inp_upper in DPAD:
-            hat = DPAD[inp_upper]
-            continue
-
-        # Check for left stick cardinal
-        if inp_upper in LEFT_STICK:
-            x, y = LEFT_STICK[inp_upper]
-            packet[3] = x
-            packet[4] = y
-            left_stick_set = True
-            continue
-
-        # Check for right stick cardinal
-        if inp_upper in RIGHT_STICK:
-            x, y = RIGHT_STICK[inp_upper]
-            packet[5] = x
-            packet[6] = y
-            right_stick_set = True
             continue
 
         raise ValueError(f"Unknown input: {inp}")
@@ -328,27 +349,54 @@ def load_macro_file(file_path: str) -> List[Dict[str, Any]]:
     if file_path.endswith('.macro') or file_path.endswith('.txt'):
         return parse_text_macro(file_path)
     elif file_path.endswith('.json'):
-        with open(file_path, 'r') as f:
-            return json.load(f)
+        with open(file_path, 'rb') as f:
+            return json_loads(f.read())
     else:
         # Try JSON first, then text
         try:
-            with open(file_path, 'r') as f:
-                return json.load(f)
+            with open(file_path, 'rb') as f:
+                return json_loads(f.read())
         except json.JSONDecodeError:
             return parse_text_macro(file_path)
 
 
-def json_to_c_header(macro_file: str, loop_macro: bool = False) -> str:
+def decode_packet(packet_data: Any, frame_index: int) -> bytes:
+    """
+    Decode a frame's packet from its JSON representation.
+
+    Args:
+        packet_data: Base64 string (C# serializer), list of byte values, or bytes
+        frame_index: Frame index for error reporting
+
+    Returns:
+        Packet as bytes
+    """
+    if isinstance(packet_data, str):
+        # Base64 encoded string from C# serializer
+        try:
+            packet = base64.b64decode(packet_data, validate=True)
+        except Exception as e:
+            raise ValueError(f"Invalid base64 packet at frame {frame_index}: {e}")
+    elif isinstance(packet_data, (list, bytes)):
+        # List of byte values from JSON, or bytes from the text parser
+        packet = bytes(packet_data)
+    else:
+        raise ValueError(f"Invalid packet format at frame {frame_index}: expected string or array, got {type(packet_data).__name__}")
+
+    if len(packet) != PACKET_SIZE:
+        raise ValueError(f"Invalid packet length at frame {frame_index}: expected {PACKET_SIZE} bytes, got {len(packet)}")
+
+    return packet
+
+
+def json_to_c_header(macro_file: str, out: TextIO, loop_macro: bool = False) -> None:
     """
     Convert macro file (JSON or text format) to C header format.
 
     Args:
         macro_file: Path to the input macro file (.json, .macro, or .txt)
+        out: Text stream the header is written to
         loop_macro: Whether to enable macro looping
-
-    Returns:
-        C header file content as a string
     """
 
     frames: List[Dict[str, Any]] = load_macro_file(macro_file)
@@ -361,6 +409,11 @@ def json_to_c_header(macro_file: str, loop_macro: bool = False) -> str:
         print(f"Error: Macro file '{macro_file}' must contain a list of frames", file=sys.stderr)
         sys.exit(1)
 
+    # Split frames into a timestamp column and one contiguous packet buffer, decoding every
+    # packet before writing so invalid input never leaves a partial header behind
+    timestamps = [frame['TimestampMs'] for frame in frames]
+    packet_buffer = b"".join(decode_packet(frame['Packet'], i) for i, frame in enumerate(frames))
+
     # Generate header
     output: List[str] = []
     output.append("// Auto-generated from macro file")
@@ -381,7 +434,7 @@ def json_to_c_header(macro_file: str, loop_macro: bool = False) -> str:
     output.append("")
 
     # Duration info
-    duration_ms = frames[-1]['TimestampMs']
+    duration_ms = timestamps[-1]
     duration_sec = duration_ms / 1000.0
     output.append(f"// Macro duration: {duration_sec:.2f} seconds ({len(frames)} frames)")
     output.append("")
@@ -396,36 +449,31 @@ def json_to_c_header(macro_file: str, loop_macro: bool = False) -> str:
     # Frame data in PROGMEM
     output.append("// Macro frames stored in program memory (PROGMEM)")
     output.append("const EmbeddedMacroFrame_t embedded_macro_frames[] PROGMEM = {")
+    out.write("\n".join(output))
 
-    for i, frame in enumerate(frames):
-        timestamp = frame['TimestampMs']
-        packet_data = frame['Packet']
-
-        # Decode packet - it might be base64 string or byte array
-        if isinstance(packet_data, str):
-            # Base64 encoded string from C# serializer
-            try:
-                packet = base64.b64decode(packet_data)
-            except Exception as e:
-                raise ValueError(f"Invalid base64 packet at frame {i}: {e}")
-        elif isinstance(packet_data, list):
-            # Already a list of bytes
-            packet = bytes(packet_data)
-        else:
-            raise ValueError(f"Invalid packet format at frame {i}: expected string or array, got {type(packet_data).__name__}")
-
-        # Format packet bytes as hex
-        packet_str = ", ".join(f"0x{b:02X}" for b in packet)
+    # Stream frame entries a chunk at a time: one %-format call renders a whole chunk,
+    # while memory stays bounded by the chunk size rather than the frame count
+    chunk_template = ",\n".join([FRAME_LINE] * FRAME_CHUNK_SIZE)
+    for start in range(0, len(timestamps), FRAME_CHUNK_SIZE):
+        chunk_timestamps = timestamps[start:start + FRAME_CHUNK_SIZE]
+        chunk_packets = packet_buffer[start * PACKET_SIZE:(start + len(chunk_timestamps)) * PACKET_SIZE]
 
-        # Add frame entry
-        comma = "," if i < len(frames) - 1 else ""
-        output.append(f"    {{ {timestamp}, {{ {packet_str} }} }}{comma}")
+        # One C-level hex conversion for the whole chunk, then turn separators into C literal prefixes.
+        # Every byte renders as "0xHH, ", so each packet is a fixed-width slice minus its trailing ", "
+        chunk_hex = "0x" + chunk_packets.hex(',').upper().replace(',', ', 0x')
+        stride = PACKET_SIZE * len("0xHH, ")
+        values: List[Any] = []
+        for pos, timestamp in zip(range(0, len(chunk_hex), stride), chunk_timestamps):
+            values.append(timestamp)
+            values.append(chunk_hex[pos:pos + stride - 2])
 
-    output.append("};")
-    output.append("")
-    output.append("#endif // EMBEDDED_MACRO_H")
+        frame_count = len(chunk_timestamps)
+        if frame_count < FRAME_CHUNK_SIZE:
+            chunk_template = ",\n".join([FRAME_LINE] * frame_count)
+        out.write(",\n" if start else "\n")
+        out.write(chunk_template % tuple(values))
 
-    return "\n".join(output)
+    out.write("\n};\n\n#endif // EMBEDDED_MACRO_H\n")
 
 
 def main() -> None:
@@ -442,14 +490,18 @@ def main() -> None:
     args = parser.parse_args()
 
     try:
-        header_content = json_to_c_header(args.macro_file, args.loop)
-
         if args.output:
-            with open(args.output, 'w') as f:
-                f.write(header_content)
+            try:
+                with open(args.output, 'w') as f:
+                    json_to_c_header(args.macro_file, f, args.loop)
+            except BaseException:
+                # Don't leave a truncated header behind for make to pick up
+                if os.path.exists(args.output):
+                    os.remove(args.output)
+                raise
             print(f"Generated {args.output}", file=sys.stderr)
         else:
-            print(header_content)
+            json_to_c_header(args.macro_file, sys.stdout, args.loop)
 
     except FileNotFoundError:
         print(f"Error: File '{args.macro_file}' not found", file=sys.stderr)